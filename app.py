@@ -1,26 +1,33 @@
 # app.py (Finals)
-from flask import Flask, request, jsonify
+from flask import Flask, request, Response
 import requests
-import hmac
-import hashlib
+from requests.adapters import HTTPAdapter
+import orjson
+import asyncio
+import functools
+import itertools
 import time
 import threading
 import os
+import queue
+import random
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 # ===========================
 # Config imports (user confirmed names)
 # ===========================
 from config import (
-    BINANCE_API_KEY,
-    BINANCE_SECRET_KEY,
-    BASE_URL,
     TRADE_AMOUNT,
     LEVERAGE,
-    MARGIN_TYPE,
     MAX_ACTIVE_TRADES,
     EXIT_MARKET_DELAY,
     OPPOSITE_CLOSE_DELAY,
+    ORDER_FILL_MAX_WAIT,
+    WORKER_POOL_SIZE,
+    SELF_PING_ENABLED,
+    SELF_PING_URL,
+    SELF_PING_INTERVAL,
     LOSS_BARS_LIMIT,            # imported from config
     DEBUG,
     get_live_pnl_for_monitor,   # use this for 2-bar monitor
@@ -33,110 +40,191 @@ from config import (
 from trade_notifier import (
     log_trade_entry,
     log_trade_exit,
+    notify_exit,
     trades as notifier_trades,
 )
+from binance_client import (
+    binance_signed_request,
+    set_leverage_and_margin,
+    invalidate_symbol_filters,
+    round_quantity,
+    round_price,
+    get_current_price,
+)
+import price_stream
+import user_stream
 
 # ===========================
 # Flask + global state
 # ===========================
 app = Flask(__name__)
 trades = notifier_trades             # shared dict with trade_notifier
-trades_lock = Lock()
 
-# ---------------------------
-# Binance signed request helper
-# ---------------------------
-def binance_signed_request(http_method, path, params=None):
-    if params is None:
-        params = {}
-    params["timestamp"] = int(time.time() * 1000)
-    query = "&".join([f"{k}={v}" for k, v in params.items()])
-    signature = hmac.new(BINANCE_SECRET_KEY.encode(), query.encode(), hashlib.sha256).hexdigest()
-    query += f"&signature={signature}"
-    url = f"{BASE_URL}{path}?{query}"
-    headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-    try:
-        if http_method == "POST":
-            r = requests.post(url, headers=headers, timeout=10)
-            return r.json()
-        elif http_method == "DELETE":
-            r = requests.delete(url, headers=headers, timeout=10)
-            return r.json()
-        else:
-            r = requests.get(url, headers=headers, timeout=10)
-            return r.json()
-    except Exception as e:
-        print("❌ Binance request failed:", e)
-        return {"error": str(e)}
+# per-symbol locks: unrelated symbols never contend with each other
+_sym_locks = {}
+_meta_lock = Lock()
 
 
-# ---------------------------
-# Exchange helpers
-# ---------------------------
-def set_leverage_and_margin(symbol):
-    try:
-        binance_signed_request("POST", "/fapi/v1/leverage", {"symbol": symbol, "leverage": LEVERAGE})
-        binance_signed_request("POST", "/fapi/v1/marginType", {"symbol": symbol, "marginType": MARGIN_TYPE})
-    except Exception as e:
-        print("❌ Failed to set leverage/margin:", e)
+def sym_lock(symbol):
+    with _meta_lock:
+        return _sym_locks.setdefault(symbol, Lock())
 
 
-def get_symbol_info(symbol):
-    try:
-        info = requests.get(f"{BASE_URL}/fapi/v1/exchangeInfo", timeout=10).json()
-        for s in info.get("symbols", []):
-            if s["symbol"] == symbol:
-                return s
-    except Exception as e:
-        print("❌ get_symbol_info error:", e)
-    return None
+def update_trade(symbol, **fields):
+    """
+    Copy-on-write update of trades[symbol].
+    A new dict with `fields` merged in is built and swapped in as a whole, so
+    readers can take `trades.get(symbol)` without a lock and always see a
+    consistent snapshot. Writers to the same symbol serialize on sym_lock.
+    """
+    with sym_lock(symbol):
+        new = {**(trades.get(symbol) or {}), **fields}
+        trades[symbol] = new
+    return new
 
 
-def round_quantity(symbol, qty):
-    info = get_symbol_info(symbol)
-    if not info:
-        try:
-            return round(qty, 3)
-        except Exception:
-            return qty
-    try:
-        step_size = float([f["stepSize"] for f in info["filters"] if f["filterType"] == "LOT_SIZE"][0])
-        min_qty = float([f["minQty"] for f in info["filters"] if f["filterType"] == "LOT_SIZE"][0])
-        # quantize to step size
-        qty = float(int(qty / step_size) * step_size)
-    except Exception:
-        qty = round(qty, 8)
-    if qty < min_qty:
-        qty = min_qty
-    return round(qty, 8)
+def update_own_trade(symbol, entry_order_id, **fields):
+    """
+    update_trade, but only while trades[symbol] is still the trade opened by
+    entry order `entry_order_id`; returns None once a newer trade replaced it.
+    """
+    with sym_lock(symbol):
+        current = trades.get(symbol)
+        if not current or current.get("entry_order_id") != entry_order_id:
+            return None
+        new = {**current, **fields}
+        trades[symbol] = new
+    return new
+
 
+# persistent worker pool for webhook workers and order waiters (bounded fan-out)
+EXECUTOR = ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE, thread_name_prefix="tv-worker")
 
-def get_current_price(symbol):
+
+def _log_task_error(fut):
+    e = fut.exception()
+    if e is not None:
+        print(f"❌ Background task failed: {e!r}")
+
+
+def submit(fn, *args, **kwargs):
+    fut = EXECUTOR.submit(fn, *args, **kwargs)
+    fut.add_done_callback(_log_task_error)
+    return fut
+
+
+def _gevent_active():
+    # gunicorn's gevent worker (Procfile) monkey-patches threading before loading the app
     try:
-        p = requests.get(f"{BASE_URL}/fapi/v1/ticker/price", params={"symbol": symbol}, timeout=5).json()
-        return float(p.get("price", 0))
-    except Exception as e:
-        print("❌ get_current_price error:", e)
-        return 0.0
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+# A pending delay is a timer, not a parked worker. Both branches were exercised
+# with gevent 24.2 on CPython 3.11: patched (as under the Procfile) and unpatched.
+if _gevent_active():
+    import gevent
+
+    def submit_later(delay, fn, *args, **kwargs):
+        """Hand fn to EXECUTOR after `delay` seconds without holding a worker thread meanwhile."""
+        gevent.spawn_later(delay, submit, fn, *args, **kwargs)
+else:
+    # plain threads (python app.py): one asyncio loop used purely as a timer
+    _TIMER_LOOP = asyncio.new_event_loop()
+    threading.Thread(target=_TIMER_LOOP.run_forever, daemon=True, name="tv-timers").start()
+
+    def submit_later(delay, fn, *args, **kwargs):
+        """Hand fn to EXECUTOR after `delay` seconds without holding a worker thread meanwhile."""
+        task = functools.partial(submit, fn, *args, **kwargs)
+        _TIMER_LOOP.call_soon_threadsafe(_TIMER_LOOP.call_later, delay, task)
+
+
+def _json_response(obj, status=200):
+    # orjson.dumps returns bytes directly; no stdlib encoder on the response path
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
 
 
 # ---------------------------
 # Active trades and qty
 # ---------------------------
 def count_active_trades():
-    try:
-        positions = binance_signed_request("GET", "/fapi/v2/positionRisk")
-        active_positions = [p for p in positions if abs(float(p.get("positionAmt", 0))) > 0]
-        return len(active_positions)
-    except Exception as e:
-        print("❌ Failed to fetch active trades:", e)
-        return 0
+    # local book, no REST round-trip: open_position records a trade before its
+    # order goes out, so pending entries hold a slot too
+    return sum(1 for t in list(trades.values()) if not t.get("closed", True))
+
+
+RECONCILE_INTERVAL = 60  # seconds between local-vs-exchange position checks
+
+
+def reconcile_active_trades():
+    """
+    Periodically compare the local trades book with positionRisk. A position
+    closed outside the app (liquidation, manual close, exchange-side stop) is
+    closed locally once it is missing on two passes in a row, so it stops
+    holding a MAX_ACTIVE_TRADES slot; one pass alone may just be a fill that
+    positionRisk doesn't show yet.
+    """
+    missing = {}
+    while True:
+        time.sleep(RECONCILE_INTERVAL)
+        try:
+            missing = _reconcile_once(missing)
+        except Exception as e:
+            print("❌ Position reconcile failed:", e)
+
+
+def _reconcile_once(prev_missing):
+    """One reconcile pass; returns {symbol: entry_order_id} of local-only trades for the next pass."""
+    positions = binance_signed_request("GET", "/fapi/v2/positionRisk")
+    if not isinstance(positions, list):
+        raise RuntimeError(positions)
+    live = {p["symbol"] for p in positions if abs(float(p.get("positionAmt", 0))) > 0}
+    open_trades = [(s, t) for s, t in list(trades.items()) if not t.get("closed", True)]
+    local = {s: t for s, t in open_trades if t.get("order_id") != "PENDING"}
+    if live != local.keys():
+        print(f"⚠️ Position drift: exchange only {sorted(live - local.keys())} | local only {sorted(local.keys() - live)}")
+
+    missing = {s: t.get("entry_order_id") for s, t in local.items() if s not in live}
+    for s, entry_order_id in missing.items():
+        # same trade missing twice: its position is gone, free the slot
+        if s in prev_missing and prev_missing[s] == entry_order_id:
+            if update_own_trade(s, entry_order_id, closed=True) is not None:
+                print(f"🧹 {s} position closed outside the app; trade marked closed")
+
+    # a reservation outliving its fill waiter would hold a MAX_ACTIVE_TRADES slot for good
+    # (without ORDER_FILL_MAX_WAIT an entry may legitimately rest indefinitely)
+    if ORDER_FILL_MAX_WAIT > 0:
+        stale_before = time.time() - ORDER_FILL_MAX_WAIT - RECONCILE_INTERVAL
+        for s, t in open_trades:
+            if t.get("order_id") == "PENDING" and t.get("entry_time", 0) < stale_before:
+                _settle_stale_entry(s, t)
+    return missing
+
+
+def _settle_stale_entry(symbol, t):
+    order_id = t.get("entry_order_id")
+    if order_id is None:
+        # the entry order was never accepted
+        _release_pending_entry(symbol, None)
+        print(f"🧹 {symbol}: stale pending entry released")
+        return
+    order = _cancel_pending_entry(symbol, order_id)
+    if float(order.get("executedQty") or 0) > 0:
+        # filled with no waiter left to record it: track it like any open trade
+        entry_price = float(order.get("avgPrice") or 0) or t.get("entry_price")
+        update_own_trade(symbol, order_id, order_id=order_id, entry_price=entry_price)
+        print(f"🧹 {symbol}: stale pending entry had filled at {entry_price}; now tracked")
+    elif trades.get(symbol, {}).get("closed", True):
+        print(f"🧹 {symbol}: stale pending entry cancelled and released")
 
 
 def calculate_quantity(symbol):
     try:
-        price_data = requests.get(f"{BASE_URL}/fapi/v1/ticker/price", params={"symbol": symbol}, timeout=5).json()
-        price = float(price_data["price"])
+        price = get_current_price(symbol)
+        if price <= 0:
+            raise ValueError(f"no price for {symbol}")
         position_value = TRADE_AMOUNT * LEVERAGE
         qty = position_value / price
         qty = round_quantity(symbol, qty)
@@ -175,117 +263,167 @@ def interval_to_seconds(interval_str: str) -> int:
 # ---------------------------
 # Background monitor: 2-bar continuous negative PnL
 # ---------------------------
+# per-bar PnL checks are timers on submit_later, so N trades cost no N sleeping threads
+_monitor_state = {}           # {symbol: {"gen", "bar_sec", "side", "loss_bars"}}
+_monitor_lock = Lock()
+_monitor_gen = itertools.count(1)
+
+
 def start_loss_bar_monitor(symbol):
     """
     Monitors live PnL for each bar interval (from trades[symbol]['interval'])
     and closes the trade if there are LOSS_BARS_LIMIT consecutive negative bars.
-    Telegram message is sent via trade_notifier.
+    Telegram message is sent via trade_notifier. Restarting for a symbol
+    replaces its previous schedule.
     """
-    def monitor():
-        from trade_notifier import notify_exit  # ✅ import inside thread to avoid circular import
-        
-        with trades_lock:
-            t = trades.get(symbol)
-            if not t:
-                return
-            interval_str = t.get("interval", "15m")
-            side = t.get("side", "")
-        bar_sec = interval_to_seconds(interval_str)
-        if DEBUG:
-            print(f"🔎 Starting loss monitor for {symbol}: interval={interval_str} ({bar_sec}s), limit={LOSS_BARS_LIMIT}")
+    t = trades.get(symbol)
+    if not t:
+        return
+    interval_str = t.get("interval", "15m")
+    bar_sec = interval_to_seconds(interval_str)
+    if DEBUG:
+        print(f"🔎 Starting loss monitor for {symbol}: interval={interval_str} ({bar_sec}s), limit={LOSS_BARS_LIMIT}")
 
-        loss_bars = 0
-        while True:
-            time.sleep(bar_sec)
+    with _monitor_lock:
+        gen = next(_monitor_gen)
+        _monitor_state[symbol] = {"gen": gen, "bar_sec": bar_sec, "side": t.get("side", ""), "loss_bars": 0}
+    _schedule_loss_bar(symbol, gen, time.monotonic() + bar_sec)
 
-            with trades_lock:
-                t = trades.get(symbol)
-                if not t or t.get("closed"):
-                    if DEBUG:
-                        print(f"🔒 Monitor stopped for {symbol}: no trade or closed.")
-                    break
-                side = t.get("side", side)
 
-            try:
-                pnl_pct = get_live_pnl_for_monitor(symbol)
-            except Exception as e:
-                pnl_pct = None
-                if DEBUG:
-                    print(f"⚠️ Error calling get_live_pnl_for_monitor for {symbol}: {e}")
-
-            if pnl_pct is None:
-                if DEBUG:
-                    print(f"⚠️ {symbol}: get_live_pnl_for_monitor returned None; skipping this bar.")
-                continue
+def _schedule_loss_bar(symbol, gen, due):
+    submit_later(max(0.0, due - time.monotonic()), _check_loss_bar, symbol, gen, due)
 
-            # Log each bar's PnL
-            print(f"📊 {symbol}: Live PnL = {pnl_pct:.2f}% | Loss Bars = {loss_bars}/{LOSS_BARS_LIMIT}")
 
-            # Count loss bars
-            if pnl_pct < 0:
-                loss_bars += 1
-                if DEBUG:
-                    print(f"⚠️ {symbol}: negative bar {loss_bars}/{LOSS_BARS_LIMIT}")
-            else:
-                if loss_bars > 0 and DEBUG:
-                    print(f"✅ {symbol}: PnL recovered (was {loss_bars} negative bars)")
-                loss_bars = 0
+def _stop_loss_bar_monitor(symbol, gen):
+    with _monitor_lock:
+        state = _monitor_state.get(symbol)
+        if state and state["gen"] == gen:
+            del _monitor_state[symbol]
 
-            # Execute close if limit reached
-            if loss_bars >= LOSS_BARS_LIMIT:
-                if DEBUG:
-                    print(f"🚨 {symbol}: {loss_bars} negative bars -> executing TWO_BAR_CLOSE_EXIT")
 
-                try:
-                    exit_price = execute_market_exit(symbol, side, reason="TWO_BAR_CLOSE_EXIT")
+def _check_loss_bar(symbol, gen, due):
+    state = _monitor_state.get(symbol)
+    if not state or state["gen"] != gen:
+        return  # superseded by a newer trade on this symbol, or stopped
+    # bar deadlines on the monotonic clock: immune to wall-clock jumps, and
+    # the time spent checking PnL doesn't push later bars back
+    next_due = due + state["bar_sec"]
 
-                    # ✅ Notify via trade_notifier only
-                    notify_exit(
-                        symbol=symbol,
-                        side=side,
-                        reason="TWO_BAR_CLOSE_EXIT",
-                        exit_price=exit_price,
-                        extra_info=f"{LOSS_BARS_LIMIT} consecutive negative bars detected"
-                    )
+    t = trades.get(symbol)
+    if not t or t.get("closed"):
+        if DEBUG:
+            print(f"🔒 Monitor stopped for {symbol}: no trade or closed.")
+        _stop_loss_bar_monitor(symbol, gen)
+        return
+    side = state["side"] = t.get("side", state["side"])
 
-                except Exception as e:
-                    print(f"❌ Failed to execute TWO_BAR_CLOSE_EXIT for {symbol}: {e}")
-                break
+    try:
+        pnl_pct = get_live_pnl_for_monitor(symbol)
+    except Exception as e:
+        pnl_pct = None
+        if DEBUG:
+            print(f"⚠️ Error calling get_live_pnl_for_monitor for {symbol}: {e}")
+
+    if pnl_pct is None:
+        if DEBUG:
+            print(f"⚠️ {symbol}: get_live_pnl_for_monitor returned None; skipping this bar.")
+        _schedule_loss_bar(symbol, gen, next_due)
+        return
+
+    # Log each bar's PnL
+    loss_bars = state["loss_bars"]
+    print(f"📊 {symbol}: Live PnL = {pnl_pct:.2f}% | Loss Bars = {loss_bars}/{LOSS_BARS_LIMIT}")
+
+    # Count loss bars
+    if pnl_pct < 0:
+        loss_bars += 1
+        if DEBUG:
+            print(f"⚠️ {symbol}: negative bar {loss_bars}/{LOSS_BARS_LIMIT}")
+    else:
+        if loss_bars > 0 and DEBUG:
+            print(f"✅ {symbol}: PnL recovered (was {loss_bars} negative bars)")
+        loss_bars = 0
+    state["loss_bars"] = loss_bars
+
+    if loss_bars < LOSS_BARS_LIMIT:
+        _schedule_loss_bar(symbol, gen, next_due)
+        return
+
+    # Execute close if limit reached
+    _stop_loss_bar_monitor(symbol, gen)
+    if DEBUG:
+        print(f"🚨 {symbol}: {loss_bars} negative bars -> executing TWO_BAR_CLOSE_EXIT")
+
+    try:
+        exit_price = execute_market_exit(symbol, side, reason="TWO_BAR_CLOSE_EXIT")
 
-    t = threading.Thread(target=monitor, daemon=True)
-    t.start()
-    return t
+        # ✅ Notify via trade_notifier only
+        notify_exit(
+            symbol=symbol,
+            side=side,
+            reason="TWO_BAR_CLOSE_EXIT",
+            exit_price=exit_price,
+            extra_info=f"{LOSS_BARS_LIMIT} consecutive negative bars detected"
+        )
+
+    except Exception as e:
+        print(f"❌ Failed to execute TWO_BAR_CLOSE_EXIT for {symbol}: {e}")
 
 # ---------------------------
 # Entry placement
 # ---------------------------
-def open_position(symbol, side, limit_price):
+def _blocks_entry(existing, replaces):
+    """True if `existing` is an open trade other than the one this entry replaces."""
+    if not existing or existing.get("closed", True):
+        return False
+    return replaces is None or existing.get("entry_order_id") != replaces
+
+
+def open_position(symbol, side, limit_price, replaces=None):
+    """
+    Reserve the symbol and send a LIMIT entry. `replaces` is the entry_order_id
+    of the trade a reversal/re-entry is closing; that trade's record may still
+    read open while its exit fills, so it neither blocks nor counts here.
+    """
+    # local state first: a resent alert for an open trade costs no round-trips
+    existing = trades.get(symbol)
+    if _blocks_entry(existing, replaces):
+        print(f"⏭️ {symbol} already has an open {existing.get('side')} trade; entry skipped")
+        return {"status": "already_open"}
+
     active_count = count_active_trades()
+    if existing and not existing.get("closed", True):
+        active_count -= 1  # the trade being replaced hands its slot over
     if active_count >= MAX_ACTIVE_TRADES:
         print(f"🚫 Max active trades reached ({active_count}/{MAX_ACTIVE_TRADES})")
         return {"status": "max_trades_reached"}
 
     set_leverage_and_margin(symbol)
     qty = calculate_quantity(symbol)
-
-    with trades_lock:
-        if symbol not in trades or trades[symbol].get("closed", True):
-            trades[symbol] = {
-                "side": side,
-                "entry_price": limit_price,
-                "order_id": "PENDING",
-                "closed": False,
-                "exit_price": None,
-                "pnl": 0,
-                "pnl_percent": 0,
-                "quantity": qty,
-                "loss_bars": 0,
-                "forced_exit": False,
-                "entry_time": time.time(),
-                "interval": "1h",
-                "last_bar_high": limit_price,
-                "last_bar_low": limit_price,
-            }
+    limit_price = round_price(symbol, limit_price)
+
+    with sym_lock(symbol):
+        existing = trades.get(symbol)
+        if _blocks_entry(existing, replaces):
+            # another worker opened this symbol while we were setting up
+            print(f"⏭️ {symbol} was opened concurrently; entry skipped")
+            return {"status": "already_open"}
+        trades[symbol] = {
+            "side": side,
+            "entry_price": limit_price,
+            "order_id": "PENDING",
+            "closed": False,
+            "exit_price": None,
+            "pnl": 0,
+            "pnl_percent": 0,
+            "quantity": qty,
+            "loss_bars": 0,
+            "forced_exit": False,
+            "entry_time": time.time(),
+            "interval": "1h",
+            "last_bar_high": limit_price,
+            "last_bar_low": limit_price,
+        }
 
     # NOTE: notifications are handled by trade_notifier, app.py will only log
     print(f"📩 Alert (log): {symbol} | {side}_ENTRY | {limit_price}")
@@ -301,58 +439,170 @@ def open_position(symbol, side, limit_price):
 
     if "orderId" in resp:
         order_id = resp["orderId"]
-        threading.Thread(target=wait_and_notify_filled_entry, args=(symbol, side, order_id), daemon=True).start()
+        # ties the reservation to its order: cleanup of this order never touches a newer trade
+        reserved = update_trade(symbol, entry_order_id=order_id)
+        submit(wait_and_notify_filled_entry, symbol, side, order_id, reserved["interval"])
     else:
         print(f"❌ Order create failed for {symbol}: {resp}")
+        invalidate_symbol_filters(resp)
+        update_trade(symbol, closed=True)  # release the slot reserved above
 
     return resp
 
 
 # ---------------------------
-# Wait for entry fill and notify
+# Notification queue: Telegram I/O stays off the order-tracking threads
 # ---------------------------
-def wait_and_notify_filled_entry(symbol, side, order_id):
-    notified = False
+_NOTIFY_Q = queue.Queue()
+
+
+def notify_async(fn, *args, **kwargs):
+    _NOTIFY_Q.put((fn, args, kwargs))
+
+
+def _notify_worker():
     while True:
-        order_status = binance_signed_request("GET", "/fapi/v1/order", {"symbol": symbol, "orderId": order_id})
-        status = order_status.get("status")
-        executed_qty = float(order_status.get("executedQty", 0)) if order_status.get("executedQty") else 0
-        avg_price = 0.0
-
-        if "fills" in order_status and order_status["fills"]:
-            num = 0.0; den = 0.0
-            for f in order_status["fills"]:
-                num += float(f.get("price", 0)) * float(f.get("qty", 0))
-                den += float(f.get("qty", 0))
-            if den > 0:
-                avg_price = num / den
-        avg_price = avg_price or float(order_status.get("avgPrice") or order_status.get("price") or 0)
-
-        if not notified and status in ("PARTIALLY_FILLED", "FILLED") and executed_qty > 0:
-            with trades_lock:
-                if symbol not in trades:
-                    trades[symbol] = {}
-                trades[symbol]["entry_price"] = avg_price
-                trades[symbol]["order_id"] = order_id
+        fn, args, kwargs = _NOTIFY_Q.get()
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            print(f"⚠️ {getattr(fn, '__name__', fn)} failed: {e}")
 
-            try:
-                # trade_notifier handles telegram notification
-                log_trade_entry(symbol, side, order_id, avg_price, trades[symbol].get("interval", "1h"))
-            except Exception:
-                print(f"📩 Filled (log): {symbol} | {side} | {avg_price}")
 
-            # ✅ Start monitoring for 2-bar negative PnL after entry confirmation
-            try:
-                start_loss_bar_monitor(symbol)
-            except Exception as e:
-                if DEBUG:
-                    print(f"⚠️ Failed to start_loss_bar_monitor for {symbol}: {e}")
+threading.Thread(target=_notify_worker, daemon=True).start()
 
-            notified = True
 
-        if status in ("FILLED", "CANCELED", "REJECTED", "EXPIRED"):
-            break
-        time.sleep(1)
+# ---------------------------
+# Order status polling backoff
+# ---------------------------
+POLL_DELAY_MIN = 0.25          # resting LIMIT entries may sit for minutes
+POLL_DELAY_MAX = 5.0
+MARKET_POLL_DELAY_MIN = 0.05   # MARKET exits usually fill within one cycle
+MARKET_POLL_DELAY_MAX = 1.0
+
+
+def _poll_sleep(delay, factor=1.5, cap=POLL_DELAY_MAX):
+    # sleep with up to 20% jitter so concurrent waiters don't poll in lockstep;
+    # cut short when the user stream (re)connects so the caller switches to pushed updates
+    user_stream.wait_connected(delay * random.uniform(1.0, 1.2))
+    return min(delay * factor, cap)
+
+
+ORDER_FILL_STATUSES = frozenset(("PARTIALLY_FILLED", "FILLED"))
+ORDER_DONE_STATUSES = frozenset(("FILLED", "CANCELED", "REJECTED", "EXPIRED"))
+USER_STREAM_WAIT = 30  # seconds to wait for a pushed update before double-checking via REST
+
+
+def _next_order_status(symbol, order_id, statuses):
+    """
+    Order status pushed by the user data stream (blocks until one of
+    `statuses` arrives) or, when the stream is down or silent, fetched via REST.
+    """
+    if user_stream.is_connected():
+        order_status = user_stream.wait_for_order(order_id, statuses, USER_STREAM_WAIT)
+        if order_status is not None:
+            return order_status
+    return binance_signed_request("GET", "/fapi/v1/order", {"symbol": symbol, "orderId": order_id})
+
+
+def _cancel_order(symbol, order_id):
+    """Cancel an order and return its final state (a fill may have raced the cancel)."""
+    binance_signed_request("DELETE", "/fapi/v1/order", {"symbol": symbol, "orderId": order_id})
+    return binance_signed_request("GET", "/fapi/v1/order", {"symbol": symbol, "orderId": order_id})
+
+
+def _release_pending_entry(symbol, order_id):
+    """Close the reservation made for entry order `order_id` if it never filled, freeing its slot."""
+    with sym_lock(symbol):
+        current = trades.get(symbol)
+        if current and current.get("entry_order_id") == order_id and current.get("order_id") == "PENDING":
+            trades[symbol] = {**current, "closed": True}
+
+
+def _cancel_pending_entry(symbol, order_id):
+    """
+    Cancel a resting entry order; its reservation is released once the order is
+    known to be done with nothing filled. Returns the order's final state (an
+    executed quantity means a fill raced the cancel).
+    """
+    order = _cancel_order(symbol, order_id)
+    if order.get("status") in ORDER_DONE_STATUSES and not float(order.get("executedQty") or 0) > 0:
+        _release_pending_entry(symbol, order_id)
+    return order
+
+
+def _average_fill_price(fills):
+    """Quantity-weighted average price of an order's fills (0.0 if none)."""
+    tot_q = 0.0
+    tot_pq = 0.0
+    for f in fills or ():
+        q = float(f.get("qty") or 0)
+        tot_q += q
+        tot_pq += float(f.get("price") or 0) * q
+    return tot_pq / tot_q if tot_q > 0 else 0.0
+
+
+# ---------------------------
+# Wait for entry fill and notify
+# ---------------------------
+def wait_and_notify_filled_entry(symbol, side, order_id, interval):
+    notified = False
+    delay = POLL_DELAY_MIN
+    t0 = time.monotonic()
+    try:
+        while True:
+            timed_out = ORDER_FILL_MAX_WAIT > 0 and time.monotonic() - t0 > ORDER_FILL_MAX_WAIT
+            if timed_out:
+                # a GTC order left resting would fill later with nobody tracking it
+                print(f"⚠️ Entry on {symbol} (orderId={order_id}) not done after {ORDER_FILL_MAX_WAIT}s; cancelling")
+                order_status = _cancel_order(symbol, order_id)
+            else:
+                watch = ORDER_DONE_STATUSES if notified else ORDER_FILL_STATUSES | ORDER_DONE_STATUSES
+                order_status = _next_order_status(symbol, order_id, watch)
+            status = order_status.get("status")
+            executed_qty = float(order_status.get("executedQty", 0)) if order_status.get("executedQty") else 0
+            avg_price = _average_fill_price(order_status.get("fills"))
+            avg_price = avg_price or float(order_status.get("avgPrice") or order_status.get("price") or 0)
+
+            # any executed quantity is a position, even on an order cancelled part-way
+            if not notified and executed_qty > 0:
+                notified = True
+                entry = update_own_trade(symbol, order_id, entry_price=avg_price, order_id=order_id)
+                if entry is None:
+                    # a reversal already replaced this trade and its exit closes this fill:
+                    # report the fill, but leave the trade book and monitor to the new trade
+                    print(f"📩 Filled after replacement (log): {symbol} | {side} | {avg_price}")
+                    notify_async(log_trade_entry, symbol, side, order_id, avg_price, interval, record=False)
+                else:
+                    # trade_notifier handles telegram notification, off this thread
+                    print(f"📩 Filled (log): {symbol} | {side} | {avg_price}")
+                    notify_async(log_trade_entry, symbol, side, order_id, avg_price, entry["interval"])
+
+                    # ✅ Start monitoring for 2-bar negative PnL after entry confirmation
+                    try:
+                        start_loss_bar_monitor(symbol)
+                    except Exception as e:
+                        if DEBUG:
+                            print(f"⚠️ Failed to start_loss_bar_monitor for {symbol}: {e}")
+
+            if status in ORDER_DONE_STATUSES or timed_out:
+                break
+            if user_stream.is_connected():
+                continue
+            if status == "PARTIALLY_FILLED":
+                # stay responsive while the order is actively executing
+                delay = POLL_DELAY_MIN
+            delay = _poll_sleep(delay)
+    except Exception:
+        if not notified:
+            # don't leave an order resting that nothing watches any more;
+            # a fill racing this cancel shows up as drift in reconcile_active_trades
+            _cancel_order(symbol, order_id)
+        raise
+    finally:
+        if not notified:
+            # done, timed out or failed with nothing filled: free the slot
+            _release_pending_entry(symbol, order_id)
 
 
 # ---------------------------
@@ -360,13 +610,23 @@ def wait_and_notify_filled_entry(symbol, side, order_id):
 # ---------------------------
 def execute_market_exit(symbol, side, reason="MARKET_CLOSE"):
     # side = "BUY" means close BUY (long) -> send SELL market
-    pos_data = binance_signed_request("GET", "/fapi/v2/positionRisk", {"symbol": symbol})
-    if not pos_data or len(pos_data) == 0 or abs(float(pos_data[0].get("positionAmt", 0))) == 0:
-        print(f"⚠️ No active position for {symbol} to close.")
-        return {"status": "no_position"}
-
-    qty = abs(float(pos_data[0]["positionAmt"]))
-    qty = round_quantity(symbol, qty)
+    # the trade this exit closes, pinned now: a reversal may record its new
+    # trade under the same symbol before the exit fills
+    closing = trades.get(symbol)
+
+    # position pushed by the user stream first; REST when it is unknown or flat,
+    # since a position opened moments ago may not have been pushed yet
+    pos_amt = user_stream.get_position_amt(symbol)
+    if not pos_amt:
+        pos_data = binance_signed_request("GET", "/fapi/v2/positionRisk", {"symbol": symbol})
+        if not pos_data or len(pos_data) == 0 or abs(float(pos_data[0].get("positionAmt", 0))) == 0:
+            print(f"⚠️ No active position for {symbol} to close.")
+            _close_without_position(symbol, closing)
+            return {"status": "no_position"}
+        pos_amt = float(pos_data[0]["positionAmt"])
+
+    pos_amt = abs(pos_amt)
+    qty = round_quantity(symbol, pos_amt)
     close_side = "SELL" if side == "BUY" else "BUY"
 
     if EXIT_MARKET_DELAY and EXIT_MARKET_DELAY > 0:
@@ -376,44 +636,79 @@ def execute_market_exit(symbol, side, reason="MARKET_CLOSE"):
         "symbol": symbol,
         "side": close_side,
         "type": "MARKET",
-        "quantity": qty
+        "quantity": qty,
+        # a close must never flip the position, even if the amount above is stale
+        "reduceOnly": "true",
     })
 
     if "orderId" in resp:
-        threading.Thread(target=wait_and_notify_filled_exit, args=(symbol, resp["orderId"], reason), daemon=True).start()
+        submit(wait_and_notify_filled_exit, symbol, resp["orderId"], reason, pos_amt, closing)
     else:
         print(f"❌ Market close failed for {symbol}: {resp}")
+        invalidate_symbol_filters(resp)
 
     return resp
 
 
-def wait_and_notify_filled_exit(symbol, order_id, reason="MARKET_CLOSE"):
+def _close_without_position(symbol, closing):
+    """Settle the pinned trade of an exit that found nothing to close, so it frees its slot."""
+    if closing is None or closing.get("closed", True):
+        return
+    if closing.get("order_id") == "PENDING" and closing.get("entry_order_id") is not None:
+        # still a resting entry: cancel it rather than leave it to fill untracked
+        _cancel_pending_entry(symbol, closing["entry_order_id"])
+    else:
+        update_own_trade(symbol, closing.get("entry_order_id"), closed=True)
+
+
+def wait_and_notify_filled_exit(symbol, order_id, reason="MARKET_CLOSE", position_qty=None, trade=None):
+    delay = MARKET_POLL_DELAY_MIN
+    t0 = time.monotonic()
     while True:
-        order_status = binance_signed_request("GET", "/fapi/v1/order", {"symbol": symbol, "orderId": order_id})
-        if order_status.get("status") == "FILLED":
+        if ORDER_FILL_MAX_WAIT > 0 and time.monotonic() - t0 > ORDER_FILL_MAX_WAIT:
+            print(f"⚠️ Gave up waiting for exit fill on {symbol} (orderId={order_id}) after {ORDER_FILL_MAX_WAIT}s")
+            break
+        order_status = _next_order_status(symbol, order_id, ORDER_DONE_STATUSES)
+        status = order_status.get("status")
+        if status == "FILLED":
+            if DEBUG:
+                print(f"⏱️ Exit fill for {symbol} detected after {(time.monotonic() - t0) * 1000:.0f} ms")
             try:
                 filled_price = float(order_status.get("avgPrice") or order_status.get("price") or 0)
             except Exception:
                 filled_price = 0.0
 
-            try:
-                # pass the reason to trade_notifier which will send the telegram message
-                log_trade_exit(symbol, filled_price, reason=reason)
-            except Exception as e:
-                print(f"⚠️ log_trade_exit failed for {symbol}: {e}")
+            closing = trade if trade is not None else trades.get(symbol)
+            if closing is not None:
+                update_own_trade(symbol, closing.get("entry_order_id"), exit_price=filled_price, closed=True)
 
-            with trades_lock:
-                if symbol in trades:
-                    trades[symbol]["exit_price"] = filled_price
-                    trades[symbol]["closed"] = True
+            # pass the reason (and the trade being closed) to trade_notifier,
+            # which sends the telegram message from the notification thread
+            notify_async(log_trade_exit, symbol, filled_price, reason=reason, trade=closing)
 
             try:
-                clean_residual_positions(symbol)
-            except Exception as e:
-                print(f"⚠️ Residual cleanup error for {symbol}: {e}")
+                executed_qty = float(order_status.get("executedQty") or 0)
+            except Exception:
+                executed_qty = 0.0
+            if position_qty and abs(executed_qty - position_qty) <= position_qty * 1e-9:
+                # the fill closed the whole pre-exit position: nothing residual to
+                # look up, only stray open orders to cancel (off this thread)
+                submit(binance_signed_request, "DELETE", "/fapi/v1/allOpenOrders", {"symbol": symbol})
+            else:
+                try:
+                    clean_residual_positions(symbol)
+                except Exception as e:
+                    print(f"⚠️ Residual cleanup error for {symbol}: {e}")
 
             break
-        time.sleep(1)
+        if status in ORDER_DONE_STATUSES:
+            print(f"⚠️ Exit order for {symbol} ended as {status} (orderId={order_id})")
+            break
+        if user_stream.is_connected():
+            continue
+        if status == "PARTIALLY_FILLED":
+            delay = MARKET_POLL_DELAY_MIN
+        delay = _poll_sleep(delay, 2, MARKET_POLL_DELAY_MAX)
 
 
 def clean_residual_positions(symbol):
@@ -434,138 +729,145 @@ def clean_residual_positions(symbol):
         print("⚠️ Residual cleanup failed:", e)
 
 
+# ---------------------------
+# Webhook worker task
+# ---------------------------
+def replace_and_open(symbol, old_side, new_side, price, reason, **bar):
+    """
+    Close the `old_side` position (if any), then after OPPOSITE_CLOSE_DELAY
+    record the alert's bar fields and open `new_side` at `price`. Top-level so
+    the webhook submits it with plain arguments instead of building closures.
+    """
+    if old_side:
+        old = trades.get(symbol) or {}
+        old_order_id = old.get("entry_order_id")
+        if old.get("order_id") == "PENDING" and old_order_id is not None:
+            # the old entry is still a resting LIMIT: there is no position to
+            # market-close, but the order itself must not stay live
+            order = _cancel_pending_entry(symbol, old_order_id)
+            if float(order.get("executedQty") or 0) > 0:
+                execute_market_exit(symbol, old_side, reason=reason)  # a fill raced the cancel
+        else:
+            execute_market_exit(symbol, old_side, reason=reason)
+        # the delay runs on the timer loop; this worker goes back to the pool
+        submit_later(OPPOSITE_CLOSE_DELAY, _open_from_alert, symbol, new_side, price, old_order_id, **bar)
+    else:
+        _open_from_alert(symbol, new_side, price, **bar)
+
+
+def _open_from_alert(symbol, side, price, replaces=None, **bar):
+    if bar:
+        update_trade(symbol, **bar)
+    open_position(symbol, side, price, replaces=replaces)
+
+
+# ---------------------------
+# Webhook handlers: (symbol, comment, close_price, bar_high, bar_low, interval)
+# ---------------------------
+def _handle_entry(side, symbol, comment, close_price, bar_high, bar_low, interval):
+    existing = trades.get(symbol)
+    old_side = existing.get("side") if existing and not existing.get("closed", True) else None
+    submit(
+        replace_and_open, symbol, old_side, side, close_price, "SAME_DIRECTION_REENTRY",
+        interval=interval,
+        last_bar_high=float(bar_high) if bar_high else close_price,
+        last_bar_low=float(bar_low) if bar_low else close_price,
+    )
+
+
+def _handle_exit(symbol, comment, close_price, bar_high, bar_low, interval):
+    cr = comment.lower()
+    if "trail" in cr:
+        reason_key = "TRAIL_CLOSE"
+    elif "loss" in cr:
+        reason_key = "STOP_LOSS"
+    else:
+        reason_key = "MARKET_CLOSE"
+
+    t = trades.get(symbol)
+    if t and not t.get("closed", True):
+        print(f"📡 {comment} received for {symbol} — initiating market close (reason={reason_key}).")
+        submit(execute_market_exit, symbol, t.get("side"), reason_key)
+    else:
+        print(f"📡 {comment} received for {symbol} but no active position found.")
+
+
+def _handle_cross(old_side, new_side, symbol, comment, close_price, bar_high, bar_low, interval):
+    submit(replace_and_open, symbol, old_side, new_side, close_price, "CROSS_EXIT")
+
+
+# exact comments; EXIT_LONG*/EXIT_SHORT* variants fall through to _handle_exit by prefix
+_WEBHOOK_HANDLERS = {
+    "BUY_ENTRY": functools.partial(_handle_entry, "BUY"),
+    "SELL_ENTRY": functools.partial(_handle_entry, "SELL"),
+    "EXIT_LONG": _handle_exit,
+    "EXIT_SHORT": _handle_exit,
+    "CROSS_EXIT_LONG": functools.partial(_handle_cross, "BUY", "SELL"),
+    "CROSS_EXIT_SHORT": functools.partial(_handle_cross, "SELL", "BUY"),
+}
+
+
 # ---------------------------
 # Webhook endpoint
 # ---------------------------
+VALID_INTERVALS = frozenset(("1m", "3m", "5m", "15m", "30m", "45m", "1h", "2h", "4h", "1d"))
+
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
-    data = request.get_data(as_text=True)
+    raw = request.get_data()
     try:
         if DEBUG:
-            print("🔔 Webhook raw payload:", data)
-
-        parts = [p.strip() for p in data.split("|")]
+            print("🔔 Webhook raw payload:", raw.decode("utf-8", "replace"))
+
+        # parse the raw bytes; only the fields we keep get stripped/decoded.
+        # maxsplit 6: anything after the 6th field stays in one ignored tail
+        parts = raw.split(b"|", 6)
+        if len(parts) < 3:
+            print("⚠️ Malformed webhook payload")
+            return _json_response({"error": "expected ticker|comment|price[|...]"}, 400)
         if len(parts) >= 6:
-            ticker, comment, close_price, bar_high, bar_low, interval = parts[:6]
+            ticker, comment, close_price, bar_high, bar_low, interval = (
+                p.strip().decode("ascii", "ignore") for p in parts[:6]
+            )
         else:
             # fallback parsing (keeps compatibility with earlier payloads)
-            ticker, comment, close_price, interval = parts[0], parts[1], parts[2], parts[-1]
+            ticker, comment, close_price, interval = (
+                parts[i].strip().decode("ascii", "ignore") for i in (0, 1, 2, -1)
+            )
             bar_high = bar_low = None
 
         # 🕒 Normalize interval from TradingView
-        interval = str(interval).lower().strip()
+        interval = interval.lower()
         if interval.isdigit():  # numeric interval (e.g., 1 → 1m)
             interval = f"{interval}m"
-
-        valid_intervals = ["1m", "3m", "5m", "15m", "30m", "45m", "1h", "2h", "4h", "1d"]
-        if interval not in valid_intervals:
+        if interval not in VALID_INTERVALS:
             interval = "1m"
 
         # normalize symbol
-        symbol = ticker.replace("USDT", "") + "USDT"
+        symbol = ticker.upper().removesuffix("USDT") + "USDT"
         try:
             close_price = float(close_price)
         except Exception:
             close_price = 0.0
 
-        comment_raw = comment
-        comment = comment.upper().strip()
+        comment = comment.upper()
 
         print(f"📩 Alert: {symbol} | {comment} | {close_price} | interval={interval}")
 
-        # =============================
-        # ENTRY: BUY
-        # =============================
-        if comment == "BUY_ENTRY":
-            with trades_lock:
-                existing = trades.get(symbol)
-
-            def worker_buy():
-                if existing and not existing.get("closed", True):
-                    execute_market_exit(symbol, existing.get("side"), reason="SAME_DIRECTION_REENTRY")
-                    time.sleep(OPPOSITE_CLOSE_DELAY)
-
-                with trades_lock:
-                    trades[symbol] = trades.get(symbol, {})
-                    trades[symbol]["interval"] = interval.lower()
-                    trades[symbol]["last_bar_high"] = float(bar_high) if bar_high else close_price
-                    trades[symbol]["last_bar_low"] = float(bar_low) if bar_low else close_price
-
-                open_position(symbol, "BUY", close_price)
-
-            threading.Thread(target=worker_buy, daemon=True).start()
-
-        # =============================
-        # ENTRY: SELL
-        # =============================
-        elif comment == "SELL_ENTRY":
-            with trades_lock:
-                existing = trades.get(symbol)
-
-            def worker_sell():
-                if existing and not existing.get("closed", True):
-                    execute_market_exit(symbol, existing.get("side"), reason="SAME_DIRECTION_REENTRY")
-                    time.sleep(OPPOSITE_CLOSE_DELAY)
-
-                with trades_lock:
-                    trades[symbol] = trades.get(symbol, {})
-                    trades[symbol]["interval"] = interval.lower()
-                    trades[symbol]["last_bar_high"] = float(bar_high) if bar_high else close_price
-                    trades[symbol]["last_bar_low"] = float(bar_low) if bar_low else close_price
-
-                open_position(symbol, "SELL", close_price)
-
-            threading.Thread(target=worker_sell, daemon=True).start()
-
-        # =============================
-        # EXIT SIGNALS
-        # =============================
-        elif comment.startswith("EXIT_LONG") or comment.startswith("EXIT_SHORT"):
-            cr = comment_raw.lower()
-            if "trail" in cr:
-                reason_key = "TRAIL_CLOSE"
-            elif "loss" in cr:
-                reason_key = "STOP_LOSS"
-            else:
-                reason_key = "MARKET_CLOSE"
-
-            with trades_lock:
-                if symbol in trades and not trades[symbol].get("closed", True):
-                    print(f"📡 {comment} received for {symbol} — initiating market close (reason={reason_key}).")
-                    threading.Thread(
-                        target=execute_market_exit,
-                        args=(symbol, trades[symbol].get("side"), reason_key),
-                        daemon=True,
-                    ).start()
-                else:
-                    print(f"📡 {comment} received for {symbol} but no active position found.")
-
-        # =============================
-        # CROSS EXIT + REVERSE ENTRY
-        # =============================
-        elif comment == "CROSS_EXIT_LONG":
-            def worker_cross_long():
-                execute_market_exit(symbol, "BUY", reason="CROSS_EXIT")
-                time.sleep(OPPOSITE_CLOSE_DELAY)
-                open_position(symbol, "SELL", close_price)
-            threading.Thread(target=worker_cross_long, daemon=True).start()
-
-        elif comment == "CROSS_EXIT_SHORT":
-            def worker_cross_short():
-                execute_market_exit(symbol, "SELL", reason="CROSS_EXIT")
-                time.sleep(OPPOSITE_CLOSE_DELAY)
-                open_position(symbol, "BUY", close_price)
-            threading.Thread(target=worker_cross_short, daemon=True).start()
-
-        else:
+        handler = _WEBHOOK_HANDLERS.get(comment)
+        if handler is None and comment.startswith(("EXIT_LONG", "EXIT_SHORT")):  # suffixed variants
+            handler = _handle_exit
+        if handler is None:
             print(f"⚠️ Unknown comment: {comment}")
-            return jsonify({"error": f"Unknown comment: {comment}"}), 400
+            return _json_response({"error": f"Unknown comment: {comment}"}, 400)
+        handler(symbol, comment, close_price, bar_high, bar_low, interval)
 
-        return jsonify({"status": "ok"})
+        return _json_response({"status": "ok"})
 
     except Exception as e:
         print("❌ Webhook Error:", e)
-        return jsonify({"error": str(e)}), 500
+        return _json_response({"error": str(e)}, 500)
 
 
 # ---------------------------
@@ -576,17 +878,33 @@ def ping():
     return "pong", 200
 
 
+# separate session so the Binance API key header never leaves for other hosts;
+# kept alive between pings so each one reuses the TCP/TLS connection
+_ping_session = requests.Session()
+_ping_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+
 def self_ping():
+    next_at = time.monotonic()
     while True:
         try:
-            requests.get(os.getenv("SELF_PING_URL", "https://tradingview-binance-trailing-dhhf.onrender.com/ping"), timeout=5)
+            # HEAD: the keep-alive only needs the request, not the body
+            # (connect, read): a stalled ping must not eat into the next interval
+            _ping_session.head(SELF_PING_URL, timeout=(2, 3))
         except Exception:
             pass
-        time.sleep(5 * 60)
+        # fixed cadence on the monotonic clock; ping time doesn't push the schedule
+        next_at += SELF_PING_INTERVAL
+        time.sleep(max(0.0, next_at - time.monotonic()))
 
 
-threading.Thread(target=self_ping, daemon=True).start()
+if SELF_PING_ENABLED:
+    threading.Thread(target=self_ping, daemon=True).start()
+threading.Thread(target=reconcile_active_trades, daemon=True).start()
+user_stream.start()
+price_stream.start()
 
+# local development only; production runs under gunicorn + gevent (see Procfile)
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
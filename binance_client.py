@@ -0,0 +1,205 @@
+# binance_client.py
+# Shared Binance Futures REST client: one pooled session, request signing,
+# symbol filters and price lookups. Imported by app.py, trade_notifier.py
+# and user_stream.py so each helper is defined exactly once.
+import threading
+import time
+import hmac
+import hashlib
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from threading import Lock
+from urllib.parse import urlencode
+
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    BINANCE_API_KEY,
+    BINANCE_SECRET_KEY,
+    BASE_URL,
+    LEVERAGE,
+    MARGIN_TYPE,
+    DEBUG,
+)
+import price_stream
+
+# one pooled, keep-alive HTTP session for all Binance traffic
+SESSION = requests.Session()
+SESSION.headers.update({"X-MBX-APIKEY": BINANCE_API_KEY or ""})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=32,
+    # connect errors and 502/503/504 on idempotent calls; order POSTs are never replayed
+    max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504]),
+))
+
+# ---------------------------
+# Binance signed request helper
+# ---------------------------
+# keyed HMAC with the ipad/opad key schedule done once; copied per signature
+_SECRET_BYTES = (BINANCE_SECRET_KEY or "").encode()
+_HMAC_PROTO = hmac.new(_SECRET_BYTES, digestmod=hashlib.sha256)
+
+
+def parse_json(r):
+    # orjson parses the (large) exchangeInfo payload several times faster than stdlib json
+    return orjson.loads(r.content)
+
+
+def signed_request(http_method, path, params=None):
+    """Send a signed request and return the raw Response (callers decide how to treat errors)."""
+    if params is None:
+        params = {}
+    params["timestamp"] = int(time.time() * 1000)
+    # escaped once; the exact same string is signed and sent
+    query = urlencode(params)
+    h = _HMAC_PROTO.copy()
+    h.update(query.encode())
+    url = f"{BASE_URL}{path}?{query}&signature={h.hexdigest()}"
+    if http_method == "POST":
+        return SESSION.post(url, timeout=10)
+    elif http_method == "DELETE":
+        return SESSION.delete(url, timeout=10)
+    return SESSION.get(url, timeout=10)
+
+
+def binance_signed_request(http_method, path, params=None):
+    try:
+        return parse_json(signed_request(http_method, path, params))
+    except Exception as e:
+        print("❌ Binance request failed:", e)
+        return {"error": str(e)}
+
+
+# ---------------------------
+# Exchange helpers
+# ---------------------------
+_lev_state = {}  # {symbol: (leverage, margin_type)} already confirmed on the exchange
+
+
+def set_leverage_and_margin(symbol):
+    if _lev_state.get(symbol) == (LEVERAGE, MARGIN_TYPE):
+        return
+    try:
+        # the two settings are independent, so send them concurrently. A one-off
+        # thread rather than EXECUTOR: callers usually already run on a pool worker.
+        lev = {}
+
+        def _set_leverage():
+            lev.update(binance_signed_request("POST", "/fapi/v1/leverage", {"symbol": symbol, "leverage": LEVERAGE}))
+
+        t = threading.Thread(target=_set_leverage, daemon=True)
+        t.start()
+        mt = binance_signed_request("POST", "/fapi/v1/marginType", {"symbol": symbol, "marginType": MARGIN_TYPE})
+        t.join()
+        # -4046 = "No need to change margin type."
+        if "leverage" in lev and mt.get("code") in (200, -4046):
+            _lev_state[symbol] = (LEVERAGE, MARGIN_TYPE)
+        elif DEBUG:
+            print(f"⚠️ Leverage/margin not confirmed for {symbol}: {lev} | {mt}")
+    except Exception as e:
+        print("❌ Failed to set leverage/margin:", e)
+
+
+SYMBOL_FILTERS_TTL = 3600        # exchangeInfo refresh interval (seconds)
+SYMBOL_FILTERS_MISS_RETRY = 60   # min seconds between refetches for an unknown symbol
+FILTER_ERROR_CODES = (-1013, -1111)  # filter failure / precision over maximum
+
+_symbol_filters = {}  # {symbol: (step_size, min_qty, tick_size)} as Decimals
+_symbol_filters_ts = 0.0
+_symbol_filters_lock = Lock()
+
+
+def _load_symbol_filters():
+    info = parse_json(SESSION.get(f"{BASE_URL}/fapi/v1/exchangeInfo", timeout=10))
+    filters = {}
+    for s in info.get("symbols", []):
+        try:
+            f = {x["filterType"]: x for x in s["filters"]}
+            filters[s["symbol"]] = (
+                Decimal(f["LOT_SIZE"]["stepSize"]),
+                Decimal(f["LOT_SIZE"]["minQty"]),
+                Decimal(f["PRICE_FILTER"]["tickSize"]),
+            )
+        except Exception:
+            continue
+    return filters
+
+
+def get_symbol_filters(symbol):
+    """
+    (step_size, min_qty, tick_size) for a symbol, as Decimals.
+    One exchangeInfo download fills the cache for every symbol; it is refreshed
+    after SYMBOL_FILTERS_TTL or when an order is rejected for a filter error.
+    """
+    global _symbol_filters, _symbol_filters_ts
+    with _symbol_filters_lock:
+        age = time.monotonic() - _symbol_filters_ts
+        cached = _symbol_filters.get(symbol)
+        if cached and age < SYMBOL_FILTERS_TTL:
+            return cached
+        if cached is None and _symbol_filters and age < SYMBOL_FILTERS_MISS_RETRY:
+            return None
+        try:
+            _symbol_filters = _load_symbol_filters()
+            _symbol_filters_ts = time.monotonic()
+        except Exception as e:
+            print("❌ get_symbol_filters error:", e)
+            return cached
+        return _symbol_filters.get(symbol)
+
+
+def invalidate_symbol_filters(resp):
+    """Force an exchangeInfo refresh when Binance rejected an order on a filter."""
+    global _symbol_filters_ts
+    if isinstance(resp, dict) and resp.get("code") in FILTER_ERROR_CODES:
+        with _symbol_filters_lock:
+            _symbol_filters_ts = 0.0
+
+
+def round_quantity(symbol, qty):
+    filters = get_symbol_filters(symbol)
+    if not filters:
+        try:
+            return round(qty, 3)
+        except Exception:
+            return qty
+    step_size, min_qty, _ = filters
+    # exact decimal floor to the step: no float drift to trip LOT_SIZE (-1013)
+    q = (Decimal(str(qty)) / step_size).to_integral_value(rounding=ROUND_DOWN) * step_size
+    if q < min_qty:
+        q = min_qty
+    return float(q)
+
+
+def round_price(symbol, price):
+    filters = get_symbol_filters(symbol)
+    if not filters or not price:
+        return price
+    tick_size = filters[2]
+    # snap to the PRICE_FILTER tick grid (nearest tick); off-grid prices are rejected
+    return float((Decimal(str(price)) / tick_size).to_integral_value(rounding=ROUND_HALF_UP) * tick_size)
+
+
+_price_cache = {}  # {symbol: (price, monotonic_ts)}
+
+
+def get_current_price(symbol, max_age=0.25):
+    price = price_stream.get_price(symbol)
+    if price:
+        return price
+    # stream down or symbol not seen yet: short-lived REST cache
+    price, ts = _price_cache.get(symbol, (0.0, 0.0))
+    if price and time.monotonic() - ts < max_age:
+        return price
+    try:
+        p = parse_json(SESSION.get(f"{BASE_URL}/fapi/v1/ticker/price", params={"symbol": symbol}, timeout=5))
+        price = float(p.get("price", 0))
+    except Exception as e:
+        print("❌ get_current_price error:", e)
+        return 0.0
+    if price:
+        _price_cache[symbol] = (price, time.monotonic())
+    return price
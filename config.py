@@ -1,9 +1,5 @@
 # config.py (final)
 import os
-import time
-import hmac
-import hashlib
-import requests
 
 # =============================
 #  ENVIRONMENT CONFIGURATION
@@ -19,7 +15,15 @@ BASE_URL = (
     else "https://fapi.binance.com"
 )
 
+WS_BASE_URL = (
+    "wss://stream.binancefuture.com"
+    if ENVIRONMENT == "TESTNET"
+    else "wss://fstream.binance.com"
+)
+
 USE_TESTNET = os.getenv("USE_TESTNET", "True").lower() == "true"
+USE_USER_STREAM = os.getenv("USE_USER_STREAM", "True").lower() == "true"
+USE_PRICE_STREAM = os.getenv("USE_PRICE_STREAM", "True").lower() == "true"
 
 # =============================
 #  TRADING PARAMETERS
@@ -30,6 +34,10 @@ MARGIN_TYPE = os.getenv("MARGIN_TYPE", "ISOLATED").upper()
 MAX_ACTIVE_TRADES = int(os.getenv("MAX_ACTIVE_TRADES", 5))
 EXIT_MARKET_DELAY = int(os.getenv("EXIT_MARKET_DELAY", 10))
 OPPOSITE_CLOSE_DELAY = int(os.getenv("OPPOSITE_CLOSE_DELAY", 3))
+# seconds an order may wait for its fill; a resting LIMIT entry still unfilled
+# after this is cancelled. 0 (default) waits indefinitely.
+ORDER_FILL_MAX_WAIT = int(os.getenv("ORDER_FILL_MAX_WAIT", 0))
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", 16))
 
 # =============================
 #  LOSS CONTROL PARAMETERS
@@ -61,21 +69,19 @@ FLASK_PORT = int(FLASK_PORT_RAW) if FLASK_PORT_RAW.isdigit() else 5000
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 LOG_FILE = os.getenv("LOG_FILE", "trades.log")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+SELF_PING_ENABLED = os.getenv("SELF_PING_ENABLED", "True").lower() == "true"
+SELF_PING_URL = os.getenv("SELF_PING_URL", "https://tradingview-binance-trailing-dhhf.onrender.com/ping")
+SELF_PING_INTERVAL = int(os.getenv("SELF_PING_INTERVAL", 5 * 60))  # keep below the host's idle timeout
 
 # =============================
 #  BINANCE SIGNED REQUEST HELPERS
 # =============================
-def _signed_get(path: str, params: dict = None, timeout: int = 10):
-    if params is None:
-        params = {}
-    params["timestamp"] = int(time.time() * 1000)
-    query = "&".join([f"{k}={v}" for k, v in params.items()])
-    signature = hmac.new(BINANCE_SECRET_KEY.encode(), query.encode(), hashlib.sha256).hexdigest()
-    url = f"{BASE_URL}{path}?{query}&signature={signature}"
-    headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-    r = requests.get(url, headers=headers, timeout=timeout)
+def _signed_get(path: str, params: dict = None):
+    # imported here: binance_client imports this module, and owns the one signing path
+    from binance_client import signed_request, parse_json
+    r = signed_request("GET", path, params)
     r.raise_for_status()
-    return r.json()
+    return parse_json(r)
 
 
 # =============================
@@ -0,0 +1,75 @@
+# price_stream.py
+import threading
+import time
+
+import orjson
+import websocket
+
+from config import (
+    WS_BASE_URL,
+    USE_PRICE_STREAM,
+    DEBUG,
+)
+
+# =======================
+# 📦 STATE
+# =======================
+PRICE_MAX_AGE = 2.0  # seconds before a streamed price counts as stale
+
+# {symbol: (mark_price, monotonic_ts)} - written only by the stream thread
+_prices = {}
+
+
+# =======================
+# 📨 STREAM
+# =======================
+def _on_message(ws, message):
+    try:
+        data = orjson.loads(message)
+    except Exception:
+        return
+    now = time.monotonic()
+    for t in data if isinstance(data, list) else ():
+        try:
+            _prices[t["s"]] = (float(t["p"]), now)
+        except Exception:
+            continue
+
+
+def _on_error(ws, error):
+    if DEBUG:
+        print("⚠️ Price stream error:", error)
+
+
+def _run():
+    # one socket for every symbol: mark prices pushed once per second
+    url = f"{WS_BASE_URL}/ws/!markPrice@arr@1s"
+    backoff = 1
+    while True:
+        try:
+            ws = websocket.WebSocketApp(url, on_message=_on_message, on_error=_on_error)
+            started = time.monotonic()
+            ws.run_forever(ping_interval=180, ping_timeout=10)
+            if time.monotonic() - started > 60:
+                backoff = 1
+        except Exception as e:
+            print("⚠️ Price stream failed:", e)
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+# =======================
+# 🚦 PUBLIC API
+# =======================
+def get_price(symbol: str, max_age: float = PRICE_MAX_AGE):
+    """Latest streamed price for symbol, or None if missing/stale (caller falls back to REST)."""
+    entry = _prices.get(symbol)
+    if entry and time.monotonic() - entry[1] < max_age:
+        return entry[0]
+    return None
+
+
+def start():
+    if not USE_PRICE_STREAM:
+        return
+    threading.Thread(target=_run, daemon=True).start()
@@ -0,0 +1,133 @@
+# tests/conftest.py
+import os
+import sys
+
+# keep app import side effects off the network: no streams, no self-ping
+os.environ.setdefault("BINANCE_API_KEY", "test-key")
+os.environ.setdefault("BINANCE_SECRET_KEY", "test-secret")
+os.environ["USE_USER_STREAM"] = "False"
+os.environ["USE_PRICE_STREAM"] = "False"
+os.environ["SELF_PING_ENABLED"] = "False"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as app_module
+import trade_notifier
+import user_stream
+
+SYMBOL = "BTCUSDT"
+
+
+class FakeExchange:
+    """Stands in for binance_signed_request: orders and positions kept in dicts."""
+
+    def __init__(self):
+        self.orders = {}       # {orderId: order dict shaped like GET /fapi/v1/order}
+        self.positions = {}    # {symbol: signed positionAmt}
+        self.calls = []        # [(method, path, params)]
+        self.next_id = 100
+        self.fill_on_cancel = set()  # orderIds whose cancel loses the race to a fill
+
+    def order(self, order_id):
+        return self.orders[order_id]
+
+    def __call__(self, http_method, path, params=None):
+        params = dict(params or {})
+        self.calls.append((http_method, path, params))
+        if path == "/fapi/v1/order" and http_method == "POST":
+            self.next_id += 1
+            self.orders[self.next_id] = {
+                "orderId": self.next_id,
+                "symbol": params["symbol"],
+                "type": params["type"],
+                "side": params["side"],
+                "status": "FILLED" if params["type"] == "MARKET" else "NEW",
+                "executedQty": str(params["quantity"]) if params["type"] == "MARKET" else "0",
+                "avgPrice": str(params.get("price", "100.0")),
+            }
+            if params["type"] == "MARKET":
+                self.positions[params["symbol"]] = 0.0
+            return {"orderId": self.next_id}
+        if path == "/fapi/v1/order" and http_method == "DELETE":
+            order = self.orders[params["orderId"]]
+            if params["orderId"] in self.fill_on_cancel:
+                order.update(status="FILLED", executedQty="1.0")
+                return {"code": -2011, "msg": "Unknown order sent."}
+            if order["status"] in ("NEW", "PARTIALLY_FILLED"):
+                order["status"] = "CANCELED"
+            return dict(order)
+        if path == "/fapi/v1/order":
+            return dict(self.orders[params["orderId"]])
+        if path == "/fapi/v2/positionRisk":
+            symbols = [params["symbol"]] if "symbol" in params else list(self.positions)
+            return [{"symbol": s, "positionAmt": str(self.positions.get(s, 0.0))} for s in symbols]
+        if path == "/fapi/v1/allOpenOrders":
+            return {"code": 200}
+        return {}
+
+    def fill(self, order_id, qty="1.0"):
+        order = self.orders[order_id]
+        order.update(status="FILLED", executedQty=qty)
+        amt = float(qty) if order["side"] == "BUY" else -float(qty)
+        self.positions[order["symbol"]] = self.positions.get(order["symbol"], 0.0) + amt
+
+
+class Tasks:
+    """Collects work handed to submit / submit_later / notify_async so tests run it explicitly."""
+
+    def __init__(self):
+        self.submitted = []
+        self.later = []
+        self.notified = []
+
+    def run_submitted(self):
+        while self.submitted:
+            fn, args, kwargs = self.submitted.pop(0)
+            fn(*args, **kwargs)
+
+    def run_later(self):
+        while self.later:
+            fn, args, kwargs = self.later.pop(0)
+            fn(*args, **kwargs)
+
+    def run_notified(self):
+        while self.notified:
+            fn, args, kwargs = self.notified.pop(0)
+            fn(*args, **kwargs)
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    fake = FakeExchange()
+    monkeypatch.setattr(app_module, "binance_signed_request", fake)
+    monkeypatch.setattr(app_module, "set_leverage_and_margin", lambda symbol: None)
+    monkeypatch.setattr(app_module, "calculate_quantity", lambda symbol: 1.0)
+    monkeypatch.setattr(app_module, "round_price", lambda symbol, price: price)
+    monkeypatch.setattr(app_module, "round_quantity", lambda symbol, qty: qty)
+    return fake
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    t = Tasks()
+    monkeypatch.setattr(app_module, "submit", lambda fn, *a, **k: t.submitted.append((fn, a, k)))
+    monkeypatch.setattr(app_module, "submit_later", lambda delay, fn, *a, **k: t.later.append((fn, a, k)))
+    monkeypatch.setattr(app_module, "notify_async", lambda fn, *a, **k: t.notified.append((fn, a, k)))
+    return t
+
+
+@pytest.fixture
+def app(monkeypatch, exchange, tasks):
+    # user data stream down: waiters poll REST, exits read positionRisk
+    monkeypatch.setattr(user_stream, "is_connected", lambda: False)
+    monkeypatch.setattr(user_stream, "get_position_amt", lambda symbol: None)
+    monkeypatch.setattr(app_module, "_poll_sleep", lambda delay, *a, **k: delay)
+    monkeypatch.setattr(app_module, "EXIT_MARKET_DELAY", 0)
+    monkeypatch.setattr(app_module, "start_loss_bar_monitor", lambda symbol: None)
+    monkeypatch.setattr(trade_notifier, "send_telegram_message", lambda msg: None)
+    monkeypatch.setattr(trade_notifier, "get_last_trade_prices", lambda symbol: (None, None))
+    app_module.trades.clear()
+    trade_notifier.notified_orders.clear()
+    yield app_module
+    app_module.trades.clear()
@@ -0,0 +1,80 @@
+# tests/test_entry_waiter.py
+import time
+
+import pytest
+
+from conftest import SYMBOL
+
+
+def _open_entry(app, tasks, side="BUY"):
+    resp = app.open_position(SYMBOL, side, 100.0)
+    assert app.trades[SYMBOL]["order_id"] == "PENDING"
+    assert app.count_active_trades() == 1
+    return resp["orderId"]
+
+
+def test_entry_timeout_cancels_order_and_releases_slot(app, exchange, tasks, monkeypatch):
+    monkeypatch.setattr(app, "ORDER_FILL_MAX_WAIT", 0.01)
+    monkeypatch.setattr(app, "_poll_sleep", lambda delay, *a, **k: time.sleep(0.02) or delay)
+    order_id = _open_entry(app, tasks)
+
+    tasks.run_submitted()
+
+    assert exchange.order(order_id)["status"] == "CANCELED"
+    assert app.trades[SYMBOL]["closed"] is True
+    assert app.count_active_trades() == 0
+
+
+def test_entry_timeout_fill_racing_cancel_is_tracked(app, exchange, tasks, monkeypatch):
+    monkeypatch.setattr(app, "ORDER_FILL_MAX_WAIT", 0.01)
+    monkeypatch.setattr(app, "_poll_sleep", lambda delay, *a, **k: time.sleep(0.02) or delay)
+    order_id = _open_entry(app, tasks)
+    exchange.fill_on_cancel.add(order_id)
+
+    tasks.run_submitted()
+
+    t = app.trades[SYMBOL]
+    assert t["closed"] is False
+    assert t["order_id"] == order_id
+    assert [fn.__name__ for fn, _, _ in tasks.notified] == ["log_trade_entry"]
+
+
+def test_no_timeout_by_default(app, exchange, tasks, monkeypatch):
+    assert app.ORDER_FILL_MAX_WAIT == 0
+    order_id = _open_entry(app, tasks)
+    polls = []
+
+    def sleep(delay, *a, **k):
+        polls.append(delay)
+        if len(polls) == 3:
+            exchange.fill(order_id)
+        return delay
+
+    monkeypatch.setattr(app, "_poll_sleep", sleep)
+    tasks.run_submitted()
+
+    assert ("DELETE", "/fapi/v1/order", {"symbol": SYMBOL, "orderId": order_id}) not in exchange.calls
+    assert app.trades[SYMBOL]["order_id"] == order_id
+    assert app.trades[SYMBOL]["closed"] is False
+
+
+def test_waiter_exception_cancels_and_releases_slot(app, exchange, tasks):
+    order_id = _open_entry(app, tasks)
+    exchange.orders[order_id]["executedQty"] = "garbage"
+
+    with pytest.raises(ValueError):
+        tasks.run_submitted()
+
+    assert exchange.order(order_id)["status"] == "CANCELED"
+    assert app.trades[SYMBOL]["closed"] is True
+    assert app.count_active_trades() == 0
+
+
+def test_cancelled_entry_releases_slot(app, exchange, tasks):
+    order_id = _open_entry(app, tasks)
+    exchange.orders[order_id]["status"] = "EXPIRED"
+
+    tasks.run_submitted()
+
+    assert app.trades[SYMBOL]["closed"] is True
+    assert tasks.notified == []
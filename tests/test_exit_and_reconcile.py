@@ -0,0 +1,91 @@
+# tests/test_exit_and_reconcile.py
+import time
+
+from conftest import SYMBOL
+
+
+def _filled_trade(order_id=7, side="BUY"):
+    return {
+        "side": side,
+        "order_id": order_id,
+        "entry_order_id": order_id,
+        "closed": False,
+        "entry_price": 100.0,
+        "entry_time": time.time(),
+    }
+
+
+def test_no_position_exit_closes_the_trade(app, exchange):
+    app.trades[SYMBOL] = _filled_trade()
+
+    resp = app.execute_market_exit(SYMBOL, "BUY")
+
+    assert resp == {"status": "no_position"}
+    assert app.trades[SYMBOL]["closed"] is True
+    assert app.count_active_trades() == 0
+
+
+def test_no_position_exit_cancels_resting_entry(app, exchange, tasks):
+    order_id = app.open_position(SYMBOL, "BUY", 100.0)["orderId"]
+
+    resp = app.execute_market_exit(SYMBOL, "BUY")
+
+    assert resp == {"status": "no_position"}
+    assert exchange.order(order_id)["status"] == "CANCELED"
+    assert app.trades[SYMBOL]["closed"] is True
+
+
+def test_no_position_exit_leaves_newer_trade_alone(app, exchange, monkeypatch):
+    app.trades[SYMBOL] = _filled_trade(order_id=7)
+    newer = _filled_trade(order_id=8, side="SELL")
+
+    def position_risk_after_reversal(http_method, path, params=None):
+        app.trades[SYMBOL] = newer  # a reversal records its trade mid-exit
+        return [{"symbol": SYMBOL, "positionAmt": "0"}]
+
+    monkeypatch.setattr(app, "binance_signed_request", position_risk_after_reversal)
+    app.execute_market_exit(SYMBOL, "BUY")
+
+    assert app.trades[SYMBOL] is newer
+
+
+def test_reconcile_closes_trade_missing_on_two_passes(app, exchange):
+    app.trades[SYMBOL] = _filled_trade()
+
+    missing = app._reconcile_once({})
+    assert app.trades[SYMBOL]["closed"] is False  # one pass may just be a fresh fill
+
+    app._reconcile_once(missing)
+    assert app.trades[SYMBOL]["closed"] is True
+
+
+def test_reconcile_keeps_trade_that_reappears(app, exchange):
+    app.trades[SYMBOL] = _filled_trade()
+
+    missing = app._reconcile_once({})
+    exchange.positions[SYMBOL] = 1.0
+    missing = app._reconcile_once(missing)
+    app._reconcile_once(missing)
+
+    assert app.trades[SYMBOL]["closed"] is False
+
+
+def test_reconcile_releases_stale_reservation(app, exchange, tasks, monkeypatch):
+    monkeypatch.setattr(app, "ORDER_FILL_MAX_WAIT", 60)
+    order_id = app.open_position(SYMBOL, "BUY", 100.0)["orderId"]
+    app.trades[SYMBOL] = {**app.trades[SYMBOL], "entry_time": time.time() - 3600}
+
+    app._reconcile_once({})
+
+    assert exchange.order(order_id)["status"] == "CANCELED"
+    assert app.trades[SYMBOL]["closed"] is True
+
+
+def test_reconcile_leaves_resting_entry_without_timeout(app, exchange, tasks):
+    order_id = app.open_position(SYMBOL, "BUY", 100.0)["orderId"]
+    app.trades[SYMBOL] = {**app.trades[SYMBOL], "entry_time": time.time() - 86400}
+
+    app._reconcile_once({})
+
+    assert exchange.order(order_id)["status"] == "NEW"
+    assert app.trades[SYMBOL]["closed"] is False
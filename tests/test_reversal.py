@@ -0,0 +1,77 @@
+# tests/test_reversal.py
+from conftest import SYMBOL
+
+import trade_notifier
+
+
+def test_reversal_over_resting_entry_cancels_it_and_opens_new_side(app, exchange, tasks):
+    old_id = app.open_position(SYMBOL, "BUY", 100.0)["orderId"]
+    tasks.submitted.clear()  # the old entry's waiter never got to run
+
+    app.replace_and_open(SYMBOL, "BUY", "SELL", 101.0, "CROSS_EXIT")
+    tasks.run_later()
+
+    assert exchange.order(old_id)["status"] == "CANCELED"
+    t = app.trades[SYMBOL]
+    assert t["side"] == "SELL"
+    assert t["entry_order_id"] != old_id
+    assert app.count_active_trades() == 1
+
+
+def test_late_entry_fill_after_reversal_keeps_new_trade(app, exchange, tasks):
+    old_id = app.open_position(SYMBOL, "BUY", 100.0)["orderId"]
+    old_waiter = tasks.submitted.pop()
+    exchange.fill_on_cancel.add(old_id)
+
+    # the old entry fills as the reversal cancels it: market-close it, then reopen
+    exchange.positions[SYMBOL] = 1.0
+    app.replace_and_open(SYMBOL, "BUY", "SELL", 101.0, "CROSS_EXIT")
+    tasks.run_later()
+    new = app.trades[SYMBOL]
+    assert new["side"] == "SELL"
+    new_id = new["entry_order_id"]
+
+    # only now does the old entry's waiter report its fill, and the exit confirm
+    fn, args, kwargs = old_waiter
+    fn(*args, **kwargs)
+    exit_waiters = [task for task in tasks.submitted if task[0] is app.wait_and_notify_filled_exit]
+    assert len(exit_waiters) == 1
+    for fn, args, kwargs in exit_waiters:
+        fn(*args, **kwargs)
+    tasks.run_notified()
+
+    t = app.trades[SYMBOL]
+    assert t["entry_order_id"] == new_id
+    assert t["side"] == "SELL"
+    assert t["order_id"] == "PENDING"
+    assert t["closed"] is False
+    assert app.count_active_trades() == 1
+    assert old_id in trade_notifier.notified_orders  # the fill was still reported
+
+
+def test_log_trade_entry_never_replaces_open_record(app):
+    app.trades[SYMBOL] = {"side": "SELL", "order_id": "PENDING", "entry_order_id": 222, "closed": False}
+
+    trade_notifier.log_trade_entry(SYMBOL, "BUY", 111, 100.0, "1h")
+
+    assert app.trades[SYMBOL]["entry_order_id"] == 222
+
+
+def test_log_trade_exit_only_closes_the_exited_trade(app):
+    newer = {"side": "SELL", "order_id": 2, "entry_order_id": 2, "closed": False, "entry_price": 100.0}
+    pending = {"side": "SELL", "order_id": "PENDING", "entry_order_id": 3, "closed": False, "entry_price": 100.0}
+    old = {"side": "BUY", "order_id": 1, "entry_order_id": 1, "closed": False, "entry_price": 100.0}
+
+    app.trades[SYMBOL] = newer
+    trade_notifier.log_trade_exit(SYMBOL, 99.0, trade=old)
+    trade_notifier.log_trade_exit(SYMBOL, 99.0)
+    assert app.trades[SYMBOL] is newer
+
+    app.trades[SYMBOL] = pending
+    trade_notifier.log_trade_exit(SYMBOL, 99.0, trade=dict(pending))
+    assert app.trades[SYMBOL] is pending
+
+    app.trades[SYMBOL] = old
+    trade_notifier.log_trade_exit(SYMBOL, 99.0, trade=old)
+    assert app.trades[SYMBOL]["closed"] is True
+    assert app.trades[SYMBOL]["exit_price"] == 99.0
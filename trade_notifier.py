@@ -1,19 +1,15 @@
 # trade_notifier.py
 import requests
 import threading
+import queue
 import time
 import datetime
-import hmac
-import hashlib
 from typing import Optional
 
 # ===============================
 # ✅ IMPORTS FROM CONFIG
 # ===============================
 from config import (
-    BINANCE_API_KEY,
-    BINANCE_SECRET_KEY,
-    BASE_URL,
     TELEGRAM_BOT_TOKEN,
     TELEGRAM_CHAT_ID,
     DEBUG,
@@ -22,6 +18,7 @@ from config import (
     get_unrealized_pnl_pct,
     LOSS_BARS_LIMIT,
 )
+from binance_client import signed_request, parse_json
 
 # =======================
 # 📦 STORAGE
@@ -34,7 +31,21 @@ pnl_neg_counter = {}     # Track consecutive negative pnl bars
 # =======================
 # 📢 TELEGRAM HELPER
 # =======================
+_TG_Q = queue.Queue()
+_tg_session = requests.Session()  # keep-alive to api.telegram.org
+
+
 def send_telegram_message(message: str):
+    """Queue a message; _telegram_worker delivers them in order, off the caller's thread."""
+    _TG_Q.put(message)
+
+
+def _telegram_worker():
+    while True:
+        _send_telegram_now(_TG_Q.get())
+
+
+def _send_telegram_now(message: str):
     try:
         if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
             if DEBUG:
@@ -42,7 +53,7 @@ def send_telegram_message(message: str):
             return
         url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message, "parse_mode": "HTML"}
-        r = requests.post(url, data=payload, timeout=10)
+        r = _tg_session.post(url, data=payload, timeout=10)
         if r.status_code != 200 and DEBUG:
             print("❌ Telegram Error:", r.status_code, r.text)
     except Exception as e:
@@ -53,31 +64,19 @@ def send_telegram_message(message: str):
 # 🔑 BINANCE SIGNED HELPERS
 # =======================
 def _signed_get(path: str, params: dict = None):
-    params = params.copy() if params else {}
-    params["timestamp"] = int(time.time() * 1000)
-    query = "&".join([f"{k}={v}" for k, v in params.items()])
-    signature = hmac.new(BINANCE_SECRET_KEY.encode(), query.encode(), hashlib.sha256).hexdigest()
-    url = f"{BASE_URL}{path}?{query}&signature={signature}"
-    headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-    resp = requests.get(url, headers=headers, timeout=10)
+    resp = signed_request("GET", path, params.copy() if params else {})
     resp.raise_for_status()
-    return resp.json()
+    return parse_json(resp)
 
 
 def _signed_post(path: str, params: dict):
-    params = params.copy()
-    params["timestamp"] = int(time.time() * 1000)
-    query = "&".join([f"{k}={v}" for k, v in params.items()])
-    signature = hmac.new(BINANCE_SECRET_KEY.encode(), query.encode(), hashlib.sha256).hexdigest()
-    url = f"{BASE_URL}{path}?{query}&signature={signature}"
-    headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-    resp = requests.post(url, headers=headers, timeout=10)
+    resp = signed_request("POST", path, params.copy())
     if DEBUG:
         try:
             print("🧾 POST:", path, resp.text)
         except Exception:
             pass
-    return resp.json()
+    return parse_json(resp)
 
 
 # =======================
@@ -139,25 +138,30 @@ def close_trade_on_binance(symbol: str, side: str):
 # =======================
 # 🟩 TRADE ENTRY
 # =======================
-def log_trade_entry(symbol: str, side: str, order_id: str, filled_price: float, interval: str):
-    if symbol in trades and trades[symbol].get("closed"):
-        trades.pop(symbol, None)
-
+def log_trade_entry(symbol: str, side: str, order_id: str, filled_price: float, interval: str, record: bool = True):
+    """
+    Send the entry message. record=False only reports the fill: app.py passes it
+    when a newer trade already replaced this one in the trade book.
+    """
     if order_id in notified_orders:
         return
     notified_orders.add(order_id)
 
-    trades[symbol] = {
-        "side": side.upper(),
-        "entry_price": filled_price,
-        "order_id": order_id,
-        "closed": False,
-        "exit_price": None,
-        "pnl": 0.0,
-        "pnl_percent": 0.0,
-        "entry_time": time.time(),
-        "interval": interval.lower(),
-    }
+    # app.py normally tracks this order already, and a newer trade may hold the
+    # symbol by now - only record the trade when no open record is there
+    current = trades.get(symbol)
+    if record and (not current or current.get("closed", True)):
+        trades[symbol] = {
+            "side": side.upper(),
+            "entry_price": filled_price,
+            "order_id": order_id,
+            "closed": False,
+            "exit_price": None,
+            "pnl": 0.0,
+            "pnl_percent": 0.0,
+            "entry_time": time.time(),
+            "interval": interval.lower(),
+        }
 
     # NOTE: monitoring will be started by app.py (start_loss_bar_monitor) to avoid duplicate monitors.
     direction_emoji = "🟩⬆️" if side.upper() == "BUY" else "🟥⬇️"
@@ -175,13 +179,18 @@ def log_trade_entry(symbol: str, side: str, order_id: str, filled_price: float,
 # =======================
 # 🟥 TRADE EXIT
 # =======================
-def log_trade_exit(symbol: str, filled_price: float, reason: str = "MARKET_CLOSE"):
+def log_trade_exit(symbol: str, filled_price: float, reason: str = "MARKET_CLOSE", trade: Optional[dict] = None):
+    """
+    `trade` is a snapshot of the trade being closed. The trade book is only
+    updated when it is given and trades[symbol] is still that same filled
+    order, so a newer trade on the same symbol is never closed by mistake.
+    """
     try:
         entry_price, exit_price = get_last_trade_prices(symbol)
         if not exit_price:
             exit_price = filled_price
 
-        t = trades.get(symbol, {})
+        t = trade if trade is not None else trades.get(symbol, {})
         side = t.get("side", "BUY")
         entry_price = entry_price or t.get("entry_price", filled_price)
         exit_price = exit_price or filled_price
@@ -213,13 +222,21 @@ def log_trade_exit(symbol: str, filled_price: float, reason: str = "MARKET_CLOSE
             f"┇Reason: <i>{reason_text}</i>"
         )
 
-        t.update({
-            "exit_price": exit_price,
-            "pnl": round(pnl_dollar, 2),
-            "pnl_percent": round(pnl_percent, 2),
-            "closed": True,
-        })
-        trades[symbol] = t
+        # publish a new dict rather than mutating the shared one (app.py reads trades lock-free)
+        current = trades.get(symbol)
+        if (
+            trade is not None
+            and trade.get("order_id") != "PENDING"
+            and current
+            and current.get("order_id") == trade.get("order_id")
+        ):
+            trades[symbol] = {
+                **t,
+                "exit_price": exit_price,
+                "pnl": round(pnl_dollar, 2),
+                "pnl_percent": round(pnl_percent, 2),
+                "closed": True,
+            }
 
         send_telegram_message(msg)
 
@@ -317,7 +334,7 @@ def monitor_negative_pnl(symbol: str):
                     if pnl_neg_counter[symbol] >= LOSS_BARS_LIMIT:
                         t = trades[symbol]
                         close_trade_on_binance(symbol, t["side"])
-                        log_trade_exit(symbol, t["entry_price"], reason="TWO_BAR_CLOSE_EXIT")
+                        log_trade_exit(symbol, t["entry_price"], reason="TWO_BAR_CLOSE_EXIT", trade=t)
                         send_telegram_message(f"⚠️ {LOSS_BARS_LIMIT}-bar close exit triggered for {symbol}")
                         break
                 else:
@@ -337,15 +354,17 @@ def send_daily_summary():
         next_run = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
         time.sleep((next_run - now).total_seconds())
 
-        closed = [t for t in trades.values() if t.get("closed")]
-        total = len(trades)
+        # one snapshot: worker threads add/replace entries while we iterate
+        snapshot = list(trades.items())
+        closed = [t for _, t in snapshot if t.get("closed")]
+        total = len(snapshot)
         win = sum(1 for t in closed if t.get("pnl", 0) > 0)
         loss = sum(1 for t in closed if t.get("pnl", 0) < 0)
-        open_ = sum(1 for t in trades.values() if not t.get("closed"))
+        open_ = total - len(closed)
         net_pnl = round(sum(t.get("pnl_percent", 0) for t in closed), 2)
 
         details = ""
-        for s, t in trades.items():
+        for s, t in snapshot:
             if t.get("closed"):
                 icon = "✅" if t.get("pnl", 0) > 0 else "⛔️"
                 details += f"#{s} {icon} {t['side']} | {t.get('pnl_percent')}% | ${t.get('pnl')}\n"
@@ -360,10 +379,11 @@ def send_daily_summary():
         )
         send_telegram_message(msg)
 
-        # cleanup closed trades
-        for s in list(trades.keys()):
-            if trades[s].get("closed"):
+        # cleanup closed trades (only if still the same closed entry we summarised)
+        for s, t in snapshot:
+            if t.get("closed") and trades.get(s) is t:
                 trades.pop(s, None)
 
 
+threading.Thread(target=_telegram_worker, daemon=True).start()
 threading.Thread(target=send_daily_summary, daemon=True).start()
@@ -0,0 +1,187 @@
+# user_stream.py
+import threading
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import orjson
+import websocket
+
+from config import (
+    BINANCE_API_KEY,
+    BASE_URL,
+    WS_BASE_URL,
+    USE_USER_STREAM,
+    DEBUG,
+)
+from binance_client import SESSION, parse_json
+
+# =======================
+# 📦 STATE
+# =======================
+LISTEN_KEY_KEEPALIVE_SEC = 30 * 60
+RECENT_ORDERS_MAX = 500
+
+_connected = threading.Event()
+_lock = Lock()
+_pending = {}            # {order_id: {"event": Event, "statuses": frozenset, "order": dict|None}}
+_recent = OrderedDict()  # {order_id: latest order dict} - covers events that beat the waiter
+_positions = {}          # {symbol: signed positionAmt} from ACCOUNT_UPDATE (one-way mode)
+
+
+# =======================
+# 🔑 LISTEN KEY
+# =======================
+def _listen_key(method: str):
+    # SESSION already carries the X-MBX-APIKEY header; listenKey calls are not signed
+    r = SESSION.request(method, f"{BASE_URL}/fapi/v1/listenKey", timeout=10)
+    r.raise_for_status()
+    return parse_json(r).get("listenKey")
+
+
+def _keepalive():
+    while True:
+        time.sleep(LISTEN_KEY_KEEPALIVE_SEC)
+        try:
+            _listen_key("PUT")
+        except Exception as e:
+            print("⚠️ listenKey keepalive failed:", e)
+
+
+# =======================
+# 📨 EVENT DISPATCH
+# =======================
+def _order_from_event(o: dict) -> dict:
+    """Map an ORDER_TRADE_UPDATE payload onto the fields of a GET /fapi/v1/order response."""
+    return {
+        "orderId": o.get("i"),
+        "symbol": o.get("s"),
+        "status": o.get("X"),
+        "executedQty": o.get("z"),
+        "avgPrice": o.get("ap"),
+        "price": o.get("L") or o.get("p"),
+    }
+
+
+def _on_message(ws, message):
+    try:
+        msg = orjson.loads(message)
+    except Exception:
+        return
+    event = msg.get("e")
+    if event == "ORDER_TRADE_UPDATE":
+        order = _order_from_event(msg.get("o", {}))
+        order_id = order["orderId"]
+        with _lock:
+            _recent[order_id] = order
+            _recent.move_to_end(order_id)
+            while len(_recent) > RECENT_ORDERS_MAX:
+                _recent.popitem(last=False)
+            waiter = _pending.get(order_id)
+            if waiter and order["status"] in waiter["statuses"]:
+                waiter["order"] = order
+                waiter["event"].set()
+    elif event == "ACCOUNT_UPDATE":
+        # only positions that changed are pushed; anything else stays unknown
+        for p in msg.get("a", {}).get("P", ()):
+            if p.get("ps", "BOTH") != "BOTH":
+                continue
+            try:
+                _positions[p["s"]] = float(p["pa"])
+            except Exception:
+                continue
+    elif event == "listenKeyExpired":
+        # reconnect loop in _run() fetches a fresh key
+        ws.close()
+
+
+def _on_open(ws):
+    # updates missed while disconnected would leave stale amounts behind
+    _positions.clear()
+    _connected.set()
+    print("🔌 User data stream connected")
+
+
+def _on_close(ws, status_code=None, msg=None):
+    _connected.clear()
+    if DEBUG:
+        print(f"🔌 User data stream closed: {status_code} {msg}")
+
+
+def _on_error(ws, error):
+    if DEBUG:
+        print("⚠️ User data stream error:", error)
+
+
+def _run():
+    backoff = 1
+    while True:
+        try:
+            key = _listen_key("POST")
+            ws = websocket.WebSocketApp(
+                f"{WS_BASE_URL}/ws/{key}",
+                on_open=_on_open,
+                on_message=_on_message,
+                on_close=_on_close,
+                on_error=_on_error,
+            )
+            started = time.monotonic()
+            ws.run_forever(ping_interval=180, ping_timeout=10)
+            if time.monotonic() - started > 60:
+                backoff = 1
+        except Exception as e:
+            print("⚠️ User data stream failed:", e)
+        _connected.clear()
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+# =======================
+# 🚦 PUBLIC API
+# =======================
+def is_connected() -> bool:
+    return _connected.is_set()
+
+
+def wait_connected(timeout: float) -> bool:
+    """Block up to `timeout` seconds for the stream to be connected; True if it is."""
+    return _connected.wait(timeout)
+
+
+def get_position_amt(symbol: str):
+    """Signed position amount last pushed for symbol, or None when unknown / the stream is down."""
+    if not _connected.is_set():
+        return None
+    return _positions.get(symbol)
+
+
+def wait_for_order(order_id, statuses, timeout: float):
+    """
+    Block until the stream reports order_id in one of `statuses`.
+    Returns a dict shaped like GET /fapi/v1/order (status, executedQty,
+    avgPrice, price), or None on timeout / when the stream is down, in
+    which case callers fall back to REST polling.
+    """
+    if not _connected.is_set():
+        return None
+    statuses = frozenset(statuses)
+    waiter = {"event": threading.Event(), "statuses": statuses, "order": None}
+    with _lock:
+        order = _recent.get(order_id)
+        if order and order["status"] in statuses:
+            return order
+        _pending[order_id] = waiter
+    try:
+        if waiter["event"].wait(timeout):
+            return waiter["order"]
+        return None
+    finally:
+        with _lock:
+            _pending.pop(order_id, None)
+
+
+def start():
+    if not USE_USER_STREAM or not BINANCE_API_KEY:
+        return
+    threading.Thread(target=_run, daemon=True).start()
+    threading.Thread(target=_keepalive, daemon=True).start()